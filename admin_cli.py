@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import sys
+
+import requests
+from dotenv import load_dotenv
+
+from event_store import STATUSES
+
+load_dotenv()
+
+DEFAULT_SERVER = os.getenv("WEBHOOK_SERVER_URL", "http://localhost:10000")
+
+
+def admin_headers():
+    token = os.getenv("ADMIN_TOKEN")
+    if not token:
+        print("❌ 環境変数 ADMIN_TOKEN が未設定です")
+        sys.exit(1)
+    return {"Authorization": f"Bearer {token}"}
+
+
+def filters_from(args):
+    """コマンドライン引数から絞り込み条件を作る"""
+    filters = {
+        "since": args.since,
+        "until": args.until,
+        "status": args.status,
+        "database_id": args.database_id,
+        "kind": args.kind,
+    }
+    return {k: v for k, v in filters.items() if v is not None}
+
+
+def list_events(args):
+    params = filters_from(args)
+    params["limit"] = args.limit
+    params["include_payload"] = args.payload
+    res = requests.get(f"{args.server}/admin/events", headers=admin_headers(), params=params)
+    if res.status_code != 200:
+        print(f"❌ 取得に失敗しました（{res.status_code}）: {res.text}")
+        sys.exit(1)
+    for event in res.json()["events"]:
+        print(json.dumps(event, ensure_ascii=False))
+
+
+def replay_events(args):
+    body = filters_from(args)
+    if args.any_status:
+        body["status"] = None
+    body["rate"] = args.rate
+    body["limit"] = args.limit
+    if args.ids:
+        body["ids"] = args.ids
+    with requests.post(f"{args.server}/admin/events/replay", headers=admin_headers(),
+                       json=body, stream=True) as res:
+        if res.status_code != 200:
+            print(f"❌ リプレイに失敗しました（{res.status_code}）: {res.text}")
+            sys.exit(1)
+        for line in res.iter_lines():
+            if not line:
+                continue
+            progress = json.loads(line)
+            if progress.get("done"):
+                print(f"✅ 完了: {progress['replayed']}件 {progress['counts']}")
+            else:
+                mark = "❌" if progress["status"] == "failed" else "🔁"
+                error = f" {progress['error']}" if progress["error"] else ""
+                print(f"{mark} #{progress['id']} {progress['status']}{error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="保存済みイベントの一覧・リプレイ")
+    parser.add_argument("--server", default=DEFAULT_SERVER, help="WebhookサーバーのURL")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name, func in (("list", list_events), ("replay", replay_events)):
+        sub = subparsers.add_parser(name)
+        sub.set_defaults(func=func)
+        sub.add_argument("--since", help="この日時以降に受信したイベント（ISO-8601）")
+        sub.add_argument("--until", help="この日時より前に受信したイベント（ISO-8601）")
+        sub.add_argument("--status", choices=STATUSES)
+        sub.add_argument("--database-id")
+        sub.add_argument("--kind", choices=["webhook", "chat"])
+        sub.add_argument("--limit", type=int, default=100)
+
+    subparsers.choices["list"].add_argument("--payload", action="store_true", help="ペイロードも表示する")
+    replay = subparsers.choices["replay"]
+    replay.add_argument("--any-status", action="store_true",
+                        help="ステータスで絞り込まない（既定は failed のみ、--ids 指定時は全ステータス。"
+                             "処理済みのイベントも再実行される）")
+    replay.add_argument("--rate", type=float, default=5.0, help="1秒あたりの再処理件数")
+    replay.add_argument("--ids", type=int, nargs="+",
+                        help="対象のイベントID（--status を付けなければステータスに関係なく再実行する）")
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import json
+import timeit
+
+from models import parse_chat, parse_webhook
+
+# 比較用のサンプルペイロード（数百KBの会話ログを想定）
+CHAT_BODY = json.dumps({
+    "message": "要約送信",
+    "title": "ベンチマーク用の会話",
+    "summary": "要約" * 200,
+    "content": "会話内容です。" * 30000,
+}, ensure_ascii=False).encode()
+
+WEBHOOK_BODY = json.dumps({
+    "id": "367cba44-b6f3-4c92-81e7-6a2e9659efd4",
+    "timestamp": "2024-12-05T23:55:34.285Z",
+    "workspace_id": "13950b26-c203-4f3b-b97d-93ec06319565",
+    "subscription_id": "29d75c0d-5546-4414-8459-7b7a92f1fc4b",
+    "integration_id": "0ef2e755-4912-8096-91c1-00376a88a5ca",
+    "type": "page.created",
+    "authors": [{"id": "c7c11cca-1d73-471d-9b6e-bdef51470190", "type": "person"}],
+    "entity": {"id": "153104cd-477e-809d-8dc4-ff2d96ae3090", "type": "page"},
+    "data": {"parent": {"id": "13950b26-c203-4f3b-b97d-93ec06319565", "type": "space"}},
+}).encode()
+
+
+def manual_chat(raw):
+    """従来の request.json() + .get による取り出し"""
+    data = json.loads(raw)
+    return (
+        data.get("message", "").lower(),
+        data.get("title", "無題の会話"),
+        data.get("content", ""),
+        data.get("summary", ""),
+    )
+
+
+def manual_webhook(raw):
+    body = json.loads(raw)
+    if body.get("type") == "url_verification":
+        return body.get("challenge")
+    return body
+
+
+def bench(label, func, raw, number):
+    seconds = min(timeit.repeat(lambda: func(raw), number=number, repeat=5))
+    print(f"{label:<28} {seconds / number * 1e6:10.1f} µs/回")
+
+
+if __name__ == "__main__":
+    print(f"=== /chat ({len(CHAT_BODY) // 1024} KB) ===")
+    bench("json.loads + .get", manual_chat, CHAT_BODY, 200)
+    bench("ChatRequest.validate_json", parse_chat, CHAT_BODY, 200)
+
+    print(f"\n=== /webhook ({len(WEBHOOK_BODY)} B) ===")
+    bench("json.loads + .get", manual_webhook, WEBHOOK_BODY, 20000)
+    bench("TypeAdapter.validate_json", parse_webhook, WEBHOOK_BODY, 20000)
@@ -0,0 +1,239 @@
+import os
+import zlib
+
+# brotli / zstandard は任意依存（未インストールならその形式を受け付けない）
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 展開後サイズの上限（zip bomb対策）。既定は10MB
+MAX_DECOMPRESSED_BYTES = int(os.getenv("MAX_DECOMPRESSED_BYTES", 10 * 1024 * 1024))
+# レスポンスをgzip圧縮する最小サイズ
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", 1024))
+
+
+class BodyEncodingError(ValueError):
+    """リクエストボディの展開に失敗した"""
+
+
+class PayloadTooLargeError(BodyEncodingError):
+    """展開後のボディが上限を超えた"""
+
+
+class UnsupportedEncodingError(BodyEncodingError):
+    """対応していないContent-Encoding"""
+
+
+class CorruptBodyError(BodyEncodingError):
+    """圧縮データが壊れている・途中で切れている"""
+
+
+def _too_large():
+    return PayloadTooLargeError("展開後のサイズが上限を超えました")
+
+
+class _ZlibDecoder:
+    """gzip / deflate 用のストリーミングデコーダ
+
+    multi_member が真なら、1つ目の圧縮データの後ろに続く次のgzipメンバー（RFC 1952）も展開する。
+    偽なら終端の後ろに残ったデータは壊れたデータとして扱う。
+    """
+
+    def __init__(self, wbits, multi_member=False):
+        self._wbits = wbits
+        self._multi_member = multi_member
+        self._obj = zlib.decompressobj(wbits)
+
+    def decompress(self, chunk, max_length):
+        out = []
+        while chunk:
+            data = self._obj.decompress(chunk, max_length)
+            # max_length に達して残ったデータがあれば上限超過
+            if self._obj.unconsumed_tail:
+                raise _too_large()
+            out.append(data)
+            max_length -= len(data)
+            if max_length <= 0:
+                # 上限に達した（0を渡すと無制限になるので、ここで返して呼び出し側に判定させる）
+                break
+            chunk = b""
+            if self._obj.eof and self._obj.unused_data:
+                if not self._multi_member:
+                    raise CorruptBodyError("圧縮データの後ろに余分なデータがあります")
+                chunk = self._obj.unused_data
+                self._obj = zlib.decompressobj(self._wbits)
+        return b"".join(out)
+
+    def flush(self, max_length):
+        out = self._obj.flush()
+        if not self._obj.eof:
+            raise CorruptBodyError("圧縮データが途中で終わっています")
+        return out
+
+
+class _DeflateDecoder(_ZlibDecoder):
+    """Content-Encoding: deflate 用。zlibヘッダ付き（RFC準拠）とヘッダなし（raw deflate）の両方を受け付ける"""
+
+    def __init__(self):
+        self._obj = None
+        self._head = b""
+        self._multi_member = False
+
+    def decompress(self, chunk, max_length):
+        if self._obj is None:
+            # 先頭2バイトがzlibヘッダとして正しいかで形式を判別する
+            self._head += chunk
+            if len(self._head) < 2:
+                return b""
+            cmf, flg = self._head[0], self._head[1]
+            has_header = cmf & 0x0F == 8 and (cmf * 256 + flg) % 31 == 0
+            self._wbits = zlib.MAX_WBITS if has_header else -zlib.MAX_WBITS
+            self._obj = zlib.decompressobj(self._wbits)
+            chunk, self._head = self._head, b""
+        return super().decompress(chunk, max_length)
+
+    def flush(self, max_length):
+        if self._obj is None:
+            raise CorruptBodyError("圧縮データが途中で終わっています")
+        return super().flush(max_length)
+
+
+class _BrotliDecoder:
+    def __init__(self):
+        self._obj = brotli.Decompressor()
+
+    def decompress(self, chunk, max_length):
+        # 出力バッファの上限を指定し、展開しきる前に打ち切る
+        out = self._obj.process(chunk, output_buffer_limit=max_length)
+        if len(out) >= max_length:
+            raise _too_large()
+        return out
+
+    def flush(self, max_length):
+        if not self._obj.is_finished():
+            raise CorruptBodyError("圧縮データが途中で終わっています")
+        return b""
+
+
+class _ZstdDecoder:
+    """zstd は出力上限を指定できないため、入力を小分けにして都度サイズを確認する
+
+    zstdのブロックは最大128KBで、RLEブロックは4バイトで1ブロック分を表せる。
+    入力を16バイトずつ渡せば1回の展開で増える量は最大512KBに収まる。
+    """
+
+    _SLICE_SIZE = 16
+
+    def __init__(self):
+        self._obj = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, chunk, max_length):
+        out = []
+        produced = 0
+        view = memoryview(chunk)
+        for i in range(0, len(view), self._SLICE_SIZE):
+            if self._obj.eof:
+                raise CorruptBodyError("圧縮データの後ろに余分なデータがあります")
+            data = self._obj.decompress(view[i:i + self._SLICE_SIZE])
+            if self._obj.eof and self._obj.unused_data:
+                raise CorruptBodyError("圧縮データの後ろに余分なデータがあります")
+            produced += len(data)
+            if produced >= max_length:
+                raise _too_large()
+            out.append(data)
+        return b"".join(out)
+
+    def flush(self, max_length):
+        if not self._obj.eof:
+            raise CorruptBodyError("圧縮データが途中で終わっています")
+        return b""
+
+
+def supported_encodings():
+    """受け付け可能なContent-Encodingの一覧"""
+    encodings = ["gzip", "deflate"]
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    return encodings
+
+
+# 各デコーダが壊れたデータに対して送出する例外
+_DECODER_ERRORS = tuple(
+    error for error in (
+        zlib.error,
+        getattr(brotli, "error", None),
+        getattr(zstandard, "ZstdError", None),
+    ) if error is not None
+)
+
+
+def _make_decoder(encoding):
+    if encoding in ("gzip", "x-gzip"):
+        return _ZlibDecoder(16 + zlib.MAX_WBITS, multi_member=True)
+    if encoding == "deflate":
+        return _DeflateDecoder()
+    if encoding == "br" and brotli is not None:
+        return _BrotliDecoder()
+    if encoding == "zstd" and zstandard is not None:
+        return _ZstdDecoder()
+    raise UnsupportedEncodingError(f"未対応のContent-Encodingです: {encoding}")
+
+
+async def read_body(request, max_bytes=MAX_DECOMPRESSED_BYTES, budget=None):
+    """Content-Encodingに従ってボディをストリーミング展開し、bytesで返す
+
+    budget を渡すと読み込んだバイト数を budget.admit() でメモリ使用量として計上する
+    （解放は呼び出し側）。高水位を超えた時点で MemoryBudgetExceeded が送出される。
+    ボディ単体で高水位を超えるものは再送しても受け付けられないので、上限超過として扱う。
+    """
+    if budget is not None:
+        max_bytes = min(max_bytes, budget.high)
+    header = request.headers.get("content-encoding", "identity")
+    # 複数指定時は適用順の逆に展開する
+    encodings = [e.strip().lower() for e in header.split(",") if e.strip()]
+    encodings = [e for e in encodings if e != "identity"]
+    decoders = [_make_decoder(e) for e in reversed(encodings)]
+
+    chunks = []
+    total = 0
+
+    def hold(data):
+        chunks.append(data)
+        if budget is not None and data:
+            budget.admit(request, len(data))
+
+    def feed(data, index):
+        """index番目以降のデコーダにデータを通す"""
+        for decoder in decoders[index:]:
+            if not data:
+                return b""
+            data = decoder.decompress(data, max_bytes - total + 1)
+        return data
+
+    try:
+        async for chunk in request.stream():
+            data = feed(chunk, 0)
+            total += len(data)
+            if total > max_bytes:
+                raise _too_large()
+            hold(data)
+
+        # 各デコーダの残りを順に押し出す
+        for i, decoder in enumerate(decoders):
+            data = feed(decoder.flush(max_bytes - total + 1), i + 1)
+            total += len(data)
+            if total > max_bytes:
+                raise _too_large()
+            hold(data)
+    except _DECODER_ERRORS as e:
+        raise CorruptBodyError(f"圧縮データを展開できません: {str(e)}") from e
+
+    return b"".join(chunks)
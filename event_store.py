@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import threading
+import time
+
+# 受信したイベントを保存するSQLiteファイル（空文字なら保存しない）
+EVENT_STORE_PATH = os.getenv("EVENT_STORE_PATH", "events.db")
+# この日数より古いイベントは削除する
+EVENT_RETENTION_DAYS = float(os.getenv("EVENT_RETENTION_DAYS", 14))
+# 古いイベントの削除を行う間隔（秒）
+_PURGE_INTERVAL = 3600
+
+# イベントの処理状態
+RECEIVED = "received"
+PROCESSED = "processed"
+IGNORED = "ignored"
+FAILED = "failed"
+STATUSES = (RECEIVED, PROCESSED, IGNORED, FAILED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    database_id TEXT,
+    received_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_received_at ON events (received_at);
+CREATE INDEX IF NOT EXISTS idx_events_status ON events (status);
+"""
+
+
+class EventStore:
+    """/webhook と /chat で受け付けたイベントの保存先"""
+
+    def __init__(self, path=EVENT_STORE_PATH, retention_days=EVENT_RETENTION_DAYS):
+        self.path = path
+        self.retention = retention_days * 86400
+        self._local = threading.local()
+        self._next_purge = 0
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        # sqlite3の接続はスレッドをまたげないため、スレッドごとに持つ
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, kind, payload, database_id=None):
+        """イベントを保存してIDを返す"""
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO events (kind, database_id, received_at, updated_at, status, payload)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, database_id, now, now, RECEIVED, payload),
+            )
+            event_id = cur.lastrowid
+        if now >= self._next_purge:
+            self._next_purge = now + _PURGE_INTERVAL
+            self.purge(now - self.retention)
+        return event_id
+
+    def purge(self, older_than):
+        """older_than（UNIX時刻）より前に受信したイベントを削除する"""
+        with self._connect() as conn:
+            return conn.execute(
+                "DELETE FROM events WHERE received_at < ?", (older_than,)
+            ).rowcount
+
+    def mark(self, event_id, status, error=None):
+        """処理結果を記録する"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE events SET status = ?, error = ?, updated_at = ?, attempts = attempts + 1"
+                " WHERE id = ?",
+                (status, error, time.time(), event_id),
+            )
+
+    def list(self, since=None, until=None, status=None, database_id=None,
+             kind=None, ids=None, after_id=0, limit=100):
+        """条件に合うイベントをID順に返す"""
+        clauses = ["id > ?"]
+        params = [after_id]
+        if since is not None:
+            clauses.append("received_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("received_at < ?")
+            params.append(until)
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if database_id is not None:
+            clauses.append("database_id = ?")
+            params.append(database_id)
+        if kind is not None:
+            clauses.append("kind = ?")
+            params.append(kind)
+        if ids:
+            clauses.append(f"id IN ({', '.join('?' * len(ids))})")
+            params.extend(ids)
+        query = f"SELECT * FROM events WHERE {' AND '.join(clauses)} ORDER BY id LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self._connect().execute(query, params)]
+
+
+_store = None
+_store_lock = threading.Lock()
+_store_unavailable = False
+
+
+def get_event_store(log=print):
+    """初回利用時にイベントストアを開く
+
+    EVENT_STORE_PATH が空、または開けない（読み取り専用の環境など）場合は
+    None を返し、イベントの保存とリプレイだけを無効にする。
+    """
+    global _store, _store_unavailable
+    if _store is not None or _store_unavailable:
+        return _store
+    with _store_lock:
+        if _store is None and not _store_unavailable:
+            if not EVENT_STORE_PATH:
+                _store_unavailable = True
+                return None
+            try:
+                _store = EventStore()
+            except sqlite3.Error as e:
+                _store_unavailable = True
+                log(f"❌ イベントストアを開けないため保存を無効にします（{EVENT_STORE_PATH}）: {str(e)}")
+    return _store
@@ -1,25 +1,73 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from notion_client import Client
 import os
 from dotenv import load_dotenv
 import requests
-from datetime import datetime
+import asyncio
+import hmac
 import json
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Literal, Optional
+from compression import (
+    GZIP_MINIMUM_SIZE,
+    BodyEncodingError,
+    CorruptBodyError,
+    PayloadTooLargeError,
+    read_body,
+    supported_encodings,
+)
+from pydantic import ValidationError
+from models import (
+    EventKind,
+    EventStatus,
+    UrlVerification,
+    parse_chat,
+    parse_replay,
+    parse_webhook,
+    validation_errors,
+)
+from timestamps import TIMEZONE, granularity_for, timestamps
+from event_store import FAILED, IGNORED, PROCESSED, get_event_store
+from sinks import SinkPipeline, sinks_from_env
+from memory_budget import MemoryBudgetExceeded, memory_budget
+from profiling import (
+    ProfilerBusyError,
+    SamplingProfiler,
+    SlowRequestMiddleware,
+    slow_requests,
+    timed,
+)
 
 # 常に.envを読み込む（開発環境でもプロダクション環境でも）
 load_dotenv()
 
 app = FastAPI()
+# 大きなレスポンスはgzip圧縮して返す
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
 
 # 環境変数の取得
 NOTION_API_KEY = os.getenv("NOTION_API_KEY")
 NOTION_DATABASE_ID = os.getenv("NOTION_DATABASE_ID").strip() if os.getenv("NOTION_DATABASE_ID") else None
 IS_PRODUCTION = os.getenv('FLASK_ENV') == 'production'
+# ログ1行あたりの最大文字数（大きなボディをそのまま出力しない）
+LOG_MAX_CHARS = int(os.getenv("LOG_MAX_CHARS", 2000))
+# 管理API（/admin/...）のBearerトークン。未設定なら管理APIは無効
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 # Notionクライアントの初期化
 notion = Client(auth=NOTION_API_KEY)
 
+def truncate_log(text):
+    """長すぎるログを切り詰める"""
+    if len(text) > LOG_MAX_CHARS:
+        return f"{text[:LOG_MAX_CHARS]}...（{len(text) - LOG_MAX_CHARS}文字省略）"
+    return text
+
 def safe_log(message, data=None):
     """本番環境ではセンシティブな情報をログ出力しない"""
     if IS_PRODUCTION:
@@ -28,15 +76,52 @@ def safe_log(message, data=None):
             safe_data = data.copy()
             if 'notion_response' in safe_data:
                 safe_data['notion_response'] = '[REDACTED]'
-            print(f"{message}: {json.dumps(safe_data, ensure_ascii=False)}")
+            print(f"{message}: {truncate_log(json.dumps(safe_data, ensure_ascii=False))}")
         else:
             print(message)
     else:
         if data:
-            print(f"{message}: {json.dumps(data, ensure_ascii=False)}")
+            print(f"{message}: {truncate_log(json.dumps(data, ensure_ascii=False))}")
         else:
             print(message)
 
+# Notion以外の書き込み先（アーカイブ・転送用webhook）
+sink_pipeline = SinkPipeline(sinks_from_env(), log=safe_log, budget=memory_budget)
+
+@app.on_event("startup")
+async def start_sinks():
+    sink_pipeline.start()
+
+@app.on_event("shutdown")
+async def stop_sinks():
+    await sink_pipeline.stop()
+
+# イベントを受け付けるエンドポイント（メモリ逼迫時に断る対象）
+INGEST_PATHS = ("/webhook", "/chat")
+
+def overloaded_response():
+    """メモリ逼迫で受け付けられないことを503で返す"""
+    return JSONResponse(
+        status_code=503,
+        content={"status": "error", "message": "サーバーが混雑しています。時間をおいて再送してください"},
+        headers={"Retry-After": "5"}
+    )
+
+@app.middleware("http")
+async def memory_guard(request: Request, call_next):
+    """メモリが高水位を超えているか、書き出し先のディスクが満杯なら新しいリクエストを断る"""
+    if request.method == "POST" and request.url.path in INGEST_PATHS and memory_budget.shedding():
+        memory_budget.record_shed()
+        return overloaded_response()
+    try:
+        return await call_next(request)
+    finally:
+        # read_body が計上したボディ分をリクエスト終了時に解放する
+        memory_budget.release(getattr(request.state, "memory_held", 0))
+
+# 遅いリクエストの内訳を記録する（最外側に置き、全ミドルウェアの時間を含める）
+app.add_middleware(SlowRequestMiddleware, recorder=slow_requests)
+
 def test_notion_connection():
     """トークンとデータベースIDの正当性を確認"""
     headers = {
@@ -58,6 +143,54 @@ def test_notion_connection():
         safe_log(f"Notion接続テストでエラー: {str(e)}")
         return False
 
+# データベースIDごとのスキーマ（プロパティ定義）のキャッシュ
+_database_schemas = {}
+# スキーマキャッシュの有効期間（秒）。取得失敗も短い期間だけキャッシュして再試行の連発を避ける
+SCHEMA_CACHE_TTL = float(os.getenv("NOTION_SCHEMA_CACHE_TTL", 300))
+SCHEMA_FAILURE_TTL = float(os.getenv("NOTION_SCHEMA_FAILURE_TTL", 30))
+# スキーマ取得のタイムアウト（秒）
+SCHEMA_FETCH_TIMEOUT = float(os.getenv("NOTION_SCHEMA_FETCH_TIMEOUT", 5))
+
+def get_database_schema(database_id):
+    """データベースのプロパティ定義を取得する（失敗時は None、結果は期限付きでキャッシュ）"""
+    cached = _database_schemas.get(database_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    headers = {
+        "Authorization": f"Bearer {NOTION_API_KEY}",
+        "Notion-Version": "2022-06-28"
+    }
+    schema = None
+    try:
+        res = requests.get(
+            f"https://api.notion.com/v1/databases/{database_id}",
+            headers=headers,
+            timeout=SCHEMA_FETCH_TIMEOUT
+        )
+        if res.status_code == 200:
+            schema = res.json().get("properties", {})
+        else:
+            safe_log("❌ データベーススキーマの取得に失敗", {"status_code": res.status_code})
+    except Exception as e:
+        safe_log(f"❌ データベーススキーマの取得でエラー: {str(e)}")
+    ttl = SCHEMA_CACHE_TTL if schema is not None else SCHEMA_FAILURE_TTL
+    _database_schemas[database_id] = (time.monotonic() + ttl, schema)
+    return schema
+
+def invalidate_database_schemas():
+    """スキーマキャッシュを破棄する（マッピング修正後のリプレイ前など）"""
+    _database_schemas.clear()
+
+def date_property_name(database_id, default="日付"):
+    """スキーマから日付型プロパティの名前を探す"""
+    schema = get_database_schema(database_id)
+    if not schema or schema.get(default, {}).get("type") == "date":
+        return default
+    for name, prop in schema.items():
+        if prop.get("type") == "date":
+            return name
+    return default
+
 def create_notion_page(title, summary, content):
     """Notionページを作成する"""
     headers = {
@@ -69,8 +202,8 @@ def create_notion_page(title, summary, content):
     # 要約とコンテンツを結合
     combined_text = f"要約:\n{summary}\n\n内容:\n{content}"
 
-    # 現在の日時を日本時間で取得（時分秒まで表示）
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # 設定したタイムゾーン（既定: 日本時間）の現在日時をデータベースの粒度で取得
+    current_time = timestamps.now(granularity_for(NOTION_DATABASE_ID))
 
     payload = {
         "parent": {"database_id": NOTION_DATABASE_ID},
@@ -83,7 +216,7 @@ def create_notion_page(title, summary, content):
             "テキスト": {
                 "rich_text": [{"text": {"content": combined_text}}]
             },
-            "日付": {
+            date_property_name(NOTION_DATABASE_ID): {
                 "date": {
                     "start": current_time
                 }
@@ -110,24 +243,145 @@ def create_notion_page(title, summary, content):
     except Exception as e:
         return False, str(e)
 
+def encoding_error_response(e):
+    """ボディ展開時のエラーをHTTPレスポンスに変換する"""
+    if isinstance(e, PayloadTooLargeError):
+        return JSONResponse(
+            status_code=413,
+            content={"status": "error", "message": str(e)}
+        )
+    if isinstance(e, CorruptBodyError):
+        return JSONResponse(
+            status_code=400,
+            content={"status": "error", "message": str(e)}
+        )
+    return JSONResponse(
+        status_code=415,
+        content={"status": "error", "message": str(e)},
+        headers={"Accept-Encoding": ", ".join(supported_encodings())}
+    )
+
+def validation_error_response(e):
+    """リクエストボディの検証エラーを422として返す"""
+    return JSONResponse(
+        status_code=422,
+        content={"status": "error", "errors": validation_errors(e)}
+    )
+
+# 自然言語トリガー（/chat でNotionに保存するかどうか）
+SAVE_TRIGGERS = ["要約送信", "notion送信", "保存", "送って", "notionに送って"]
+
+def should_save(body):
+    """チャットのメッセージに保存トリガーが含まれるか"""
+    message = body.message.lower()
+    return any(trigger in message for trigger in SAVE_TRIGGERS)
+
+def store_event(kind, raw, database_id):
+    """イベントを保存してIDを返す（保存が無効なら None）"""
+    store = get_event_store(log=safe_log)
+    if store is None:
+        return None
+    # デコードした文字列の分もメモリ使用量に数える
+    with memory_budget.hold(len(raw)):
+        return store.add(kind, raw.decode(), database_id)
+
+def dispatch_event(kind, body):
+    """検証済みイベントを処理する（ライブ受信とリプレイで共通）
+
+    戻り値は (ステータス, 結果)。失敗時の結果はエラーメッセージ。
+    """
+    if kind == "chat":
+        if not should_save(body):
+            return IGNORED, None
+        with timed("notion"):
+            success, result = create_notion_page(body.title, body.summary, body.content)
+        return (PROCESSED if success else FAILED), result
+    # webhookイベントは受信の記録のみ（データベース処理ロジックはここに追加する）
+    return PROCESSED, None
+
+def process_event(event_id, kind, body):
+    """イベントを処理し、結果をイベントストアに記録する"""
+    try:
+        status, result = dispatch_event(kind, body)
+    except Exception as e:
+        status, result = FAILED, str(e)
+    store = get_event_store(log=safe_log)
+    if event_id is not None and store is not None:
+        try:
+            store.mark(event_id, status, result if status == FAILED else None)
+        except Exception as e:
+            # 処理自体は終わっているので、記録の失敗はログに残すだけにする
+            safe_log("❌ イベントの処理結果を記録できませんでした", {"event_id": event_id, "error": str(e)})
+    return status, result
+
+def process_for_sinks(event_id, kind, body, database_id, size, received_at):
+    """イベントを処理し、Notionに保存できたものは副次シンク向けにシリアライズする
+
+    戻り値は (ステータス, 結果, シリアライズ済みのイベントまたは None)。
+    size は元のボディのバイト数で、シリアライズ中の一時的なコピーの見積もりに使う。
+    """
+    status, result = process_event(event_id, kind, body)
+    if status != PROCESSED or not sink_pipeline.workers:
+        return status, result, None
+    # model_dump の辞書とJSON文字列の2つ分を数える
+    with memory_budget.hold(2 * size):
+        data = json.dumps({
+            "event_id": event_id,
+            "kind": kind,
+            "database_id": database_id,
+            "received_at": datetime.fromtimestamp(received_at or time.time(), TIMEZONE).isoformat(),
+            "notion_page_id": result.get("id") if isinstance(result, dict) else None,
+            "body": body.model_dump(mode="json", exclude_unset=True),
+        }, ensure_ascii=False).encode()
+    return status, result, data
+
+async def handle_event(event_id, kind, body, database_id, size, received_at=None):
+    """イベントを処理し、Notionに保存できたものを副次シンクへ流す"""
+    # 大きな会話ログのシリアライズでイベントループを止めないよう、処理と一緒にスレッドで行う
+    status, result, data = await run_in_threadpool(
+        process_for_sinks, event_id, kind, body, database_id, size, received_at
+    )
+    if data is not None:
+        sink_pipeline.publish(data)
+    return status, result
+
 @app.post("/webhook")
 async def handle_webhook(request: Request):
     try:
-        body = await request.json()
+        with timed("read_body"):
+            raw = await read_body(request, budget=memory_budget)
+        with timed("validate"):
+            body = parse_webhook(raw)
+        # 検証済みモデルもボディと同程度のメモリを使うものとして数える
+        memory_budget.hold_for(request, len(raw))
         
         # Notionのwebhook認証チャレンジに応答
-        if body.get("type") == "url_verification":
-            challenge = body.get("challenge")
+        if isinstance(body, UrlVerification):
+            challenge = body.challenge
             safe_log("📝 Webhook認証チャレンジを受信", {"challenge": challenge})
             return JSONResponse({"type": "url_verification", "challenge": challenge})
         
         # 通常のwebhookリクエストの処理
-        safe_log("📥 Webhookリクエストを受信", {"body": body})
+        # ボディ全体を辞書に展開し直さないよう、ログには概要だけを残す
+        safe_log("📥 Webhookリクエストを受信", {"id": body.id, "type": body.type, "bytes": len(raw)})
         
         # 既存のNotion処理ロジック
         database_id = os.environ["NOTION_DATABASE_ID"]
-        # データベース処理ロジック
+        with timed("event_store"):
+            event_id = await run_in_threadpool(store_event, "webhook", raw, database_id)
+        status, result = await handle_event(event_id, "webhook", body, database_id, len(raw))
+        if status == FAILED:
+            raise RuntimeError(result)
         return JSONResponse({"status": "success"})
+    except MemoryBudgetExceeded:
+        return overloaded_response()
+    except BodyEncodingError as e:
+        safe_log("❌ Webhookボディ展開エラー", {"error": str(e)})
+        return encoding_error_response(e)
+    except ValidationError as e:
+        # str(e) は入力値を含むので、入力値を除いたエラー箇所だけを残す
+        safe_log("❌ Webhookボディ検証エラー", {"errors": validation_errors(e)})
+        return validation_error_response(e)
     except Exception as e:
         safe_log("❌ Webhookエラー", {"error": str(e)})
         return JSONResponse(
@@ -135,6 +389,240 @@ async def handle_webhook(request: Request):
             content={"status": "error", "message": str(e)}
         )
 
+@app.post("/chat")
+async def handle_chat(request: Request):
+    """チャット内容を受け取り、必要に応じてNotionに保存する"""
+    try:
+        with timed("read_body"):
+            raw = await read_body(request, budget=memory_budget)
+        with timed("validate"):
+            data = parse_chat(raw)
+    except MemoryBudgetExceeded:
+        return overloaded_response()
+    except BodyEncodingError as e:
+        safe_log("❌ Chatボディ展開エラー", {"error": str(e)})
+        return encoding_error_response(e)
+    except ValidationError as e:
+        safe_log("❌ Chatボディ検証エラー", {"errors": validation_errors(e)})
+        return validation_error_response(e)
+    if not data.model_fields_set:
+        return JSONResponse(status_code=400, content={"error": "No data provided"})
+    # 検証済みモデルもボディと同程度のメモリを使うものとして数える
+    memory_budget.hold_for(request, len(raw))
+
+    # 保存トリガーのない会話は保存もしない（大きな会話ログでストアを膨らませない）
+    if not should_save(data):
+        return JSONResponse({
+            "status": "ignored",
+            "message": "保存トリガーが検出されませんでした"
+        })
+
+    try:
+        with timed("event_store"):
+            event_id = await run_in_threadpool(store_event, "chat", raw, NOTION_DATABASE_ID)
+    except Exception as e:
+        safe_log("❌ Chatイベントの保存エラー", {"error": str(e)})
+        return JSONResponse(
+            status_code=500,
+            content={"status": "error", "message": str(e)}
+        )
+    status, result = await handle_event(event_id, "chat", data, NOTION_DATABASE_ID, len(raw))
+
+    if status == PROCESSED:
+        return JSONResponse({
+            "status": "success",
+            "message": "Notionに保存しました",
+            "page_id": result["id"]
+        })
+    elif status == FAILED:
+        return JSONResponse(
+            status_code=500,
+            content={
+                "status": "error",
+                "message": f"Notionへの保存に失敗しました: {result}"
+            }
+        )
+    else:
+        return JSONResponse({
+            "status": "ignored",
+            "message": "保存トリガーが検出されませんでした"
+        })
+
+def require_admin(request: Request):
+    """管理APIのBearerトークンを確認する"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="ADMIN_TOKEN が未設定のため管理APIは無効です")
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(
+            status_code=401,
+            detail="認証に失敗しました",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+def to_epoch(value):
+    """日時をUNIX時刻に変換する（タイムゾーンなしは設定タイムゾーンとみなす）"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=TIMEZONE)
+    return value.timestamp()
+
+def event_summary(row, include_payload=False):
+    """管理APIで返すイベント情報"""
+    summary = {
+        "id": row["id"],
+        "kind": row["kind"],
+        "database_id": row["database_id"],
+        "received_at": datetime.fromtimestamp(row["received_at"], TIMEZONE).isoformat(),
+        "status": row["status"],
+        "attempts": row["attempts"],
+        "error": row["error"],
+    }
+    if include_payload:
+        summary["payload"] = row["payload"]
+    return summary
+
+def require_event_store():
+    """イベントストアが使えなければ503にする"""
+    store = get_event_store(log=safe_log)
+    if store is None:
+        raise HTTPException(status_code=503, detail="イベントストアが無効です（EVENT_STORE_PATH を確認してください）")
+    return store
+
+@app.get("/admin/events", dependencies=[Depends(require_admin)])
+async def list_events(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    status: Optional[EventStatus] = None,
+    database_id: Optional[str] = None,
+    kind: Optional[EventKind] = None,
+    after_id: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    include_payload: bool = False
+):
+    """保存済みイベントを絞り込んで一覧する"""
+    store = require_event_store()
+    rows = await run_in_threadpool(
+        store.list,
+        since=to_epoch(since),
+        until=to_epoch(until),
+        status=status,
+        database_id=database_id,
+        kind=kind,
+        after_id=after_id,
+        limit=limit
+    )
+    return {"events": [event_summary(row, include_payload) for row in rows]}
+
+async def replay_event(store, row):
+    """保存済みイベントを再検証し、通常の処理に流し直す"""
+    try:
+        parse = parse_chat if row["kind"] == "chat" else parse_webhook
+        body = parse(row["payload"])
+    except ValidationError as e:
+        await run_in_threadpool(store.mark, row["id"], FAILED, str(e))
+        return FAILED, str(e)
+    return await handle_event(
+        row["id"], row["kind"], body, row["database_id"], len(row["payload"]), row["received_at"]
+    )
+
+async def replay_stream(store, params):
+    """イベントを一定間隔で再処理し、進捗をNDJSONで返す"""
+    filters = {
+        "since": to_epoch(params.since),
+        "until": to_epoch(params.until),
+        "status": params.status,
+        "database_id": params.database_id,
+        "kind": params.kind,
+        "ids": params.ids,
+    }
+    # スキーマ修正後のリプレイで古いプロパティ名を使わないよう取り直す
+    invalidate_database_schemas()
+    interval = 1 / params.rate
+    counts = Counter()
+    replayed = 0
+    after_id = 0
+    while replayed < params.limit:
+        rows = await run_in_threadpool(
+            store.list,
+            after_id=after_id,
+            limit=min(100, params.limit - replayed),
+            **filters
+        )
+        if not rows:
+            break
+        for row in rows:
+            started = time.monotonic()
+            # Notionへの書き込みはスレッドプールで行い、ライブの処理を止めない
+            status, result = await replay_event(store, row)
+            counts[status] += 1
+            replayed += 1
+            yield json.dumps({
+                "id": row["id"],
+                "status": status,
+                "error": result if status == FAILED else None
+            }, ensure_ascii=False) + "\n"
+            await asyncio.sleep(max(0, interval - (time.monotonic() - started)))
+        after_id = rows[-1]["id"]
+    safe_log("🔁 イベントのリプレイが完了", {"replayed": replayed, "counts": dict(counts)})
+    yield json.dumps({"done": True, "replayed": replayed, "counts": dict(counts)}) + "\n"
+
+@app.post("/admin/events/replay", dependencies=[Depends(require_admin)])
+async def replay_events(request: Request):
+    """条件に合う保存済みイベントをまとめて再処理する"""
+    try:
+        params = parse_replay(await read_body(request) or b"{}")
+    except BodyEncodingError as e:
+        return encoding_error_response(e)
+    except ValidationError as e:
+        return validation_error_response(e)
+    store = require_event_store()
+    # GZipMiddleware はバッファリングして進捗が届かなくなるので、圧縮せずに返す
+    # （Content-Encoding が指定済みのレスポンスはそのまま通される）
+    return StreamingResponse(
+        replay_stream(store, params),
+        media_type="application/x-ndjson",
+        headers={"Content-Encoding": "identity"}
+    )
+
+@app.get("/admin/sinks", dependencies=[Depends(require_admin)])
+async def sink_stats():
+    """副次シンクごとのキュー長と書き込み件数"""
+    return {"sinks": sink_pipeline.stats()}
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile(
+    seconds: float = Query(10, gt=0),
+    # 間隔が短すぎるとサンプリング自体がGILを握り続け、対象のワーカーを止めてしまう
+    interval_ms: float = Query(5, ge=1),
+    format: Literal["collapsed", "speedscope"] = "collapsed"
+):
+    """実行中のワーカーを指定秒数だけサンプリングプロファイルする"""
+    profiler = SamplingProfiler(interval=interval_ms / 1000)
+    try:
+        # サンプリングは別スレッドで行い、その間もイベントループは動き続ける
+        await asyncio.to_thread(profiler.run, seconds)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    safe_log("🔬 プロファイルを取得", {"samples": profiler.samples, "seconds": round(profiler.elapsed, 2)})
+    if format == "speedscope":
+        return JSONResponse(profiler.speedscope())
+    return PlainTextResponse(profiler.collapsed())
+
+@app.get("/admin/slow-requests", dependencies=[Depends(require_admin)])
+async def slow_request_log():
+    """しきい値を超えたリクエストの処理時間の内訳（新しい順）"""
+    return {
+        "threshold_ms": slow_requests.threshold * 1000,
+        "requests": slow_requests.recent()
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """メモリ使用量と副次シンクの状況"""
+    return {"memory": memory_budget.stats(), "sinks": sink_pipeline.stats()}
+
 @app.get("/")
 async def root():
     return {"message": "Notion Webhook Server is running"}
@@ -0,0 +1,173 @@
+import os
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+
+# メモリ上に保持するバイト数の上限・下限（この間はヒステリシス）
+MEMORY_HIGH_WATERMARK = int(os.getenv("MEMORY_HIGH_WATERMARK", 64 * 1024 * 1024))
+MEMORY_LOW_WATERMARK = int(os.getenv("MEMORY_LOW_WATERMARK", 48 * 1024 * 1024))
+# 高水位を超えた分を書き出すディレクトリと、その容量上限
+SPILL_DIR = os.getenv("SPILL_DIR", os.path.join(tempfile.gettempdir(), "webhook-spill"))
+SPILL_MAX_BYTES = int(os.getenv("SPILL_MAX_BYTES", 256 * 1024 * 1024))
+
+
+class MemoryBudgetExceeded(Exception):
+    """メモリもディスクも上限に達して受け付けられない"""
+
+
+class SpilledPayload:
+    """ディスクに書き出したペイロード"""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+
+class MemoryBudget:
+    """ボディ・キュー内ペイロードなどメモリ上のバイト数を集計する"""
+
+    def __init__(self, high=MEMORY_HIGH_WATERMARK, low=MEMORY_LOW_WATERMARK,
+                 spill_dir=SPILL_DIR, spill_max=SPILL_MAX_BYTES):
+        if low > high:
+            raise ValueError("MEMORY_LOW_WATERMARK は MEMORY_HIGH_WATERMARK 以下にしてください")
+        self.high = high
+        self.low = low
+        self.spill_dir = spill_dir
+        self.spill_max = spill_max
+        self.held = 0
+        self.spilled = 0
+        self.peak = 0
+        self.spill_count = 0
+        self.shed_count = 0
+        self._over_high = False
+        # store() がディスク上限で断ってから、書き出し済みのものが消えるまで True
+        self._spill_full = False
+        self._lock = threading.Lock()
+
+    def _update_state(self):
+        # 高水位を超えたら、低水位を下回るまで書き出しを続ける
+        if self.held > self.high:
+            self._over_high = True
+        elif self.held < self.low:
+            self._over_high = False
+        self.peak = max(self.peak, self.held)
+
+    def reserve(self, size):
+        with self._lock:
+            self.held += size
+            self._update_state()
+
+    def release(self, size):
+        with self._lock:
+            self.held -= size
+            self._update_state()
+
+    @contextmanager
+    def hold(self, size):
+        """with の間だけ size バイトを保持中として数える"""
+        self.reserve(size)
+        try:
+            yield
+        finally:
+            self.release(size)
+
+    def hold_for(self, request, size):
+        """size バイトをリクエスト終了時まで保持中として数え、高水位を超えているかを返す
+
+        計上した量は request.state.memory_held に足していく（解放はミドルウェア）。
+        """
+        with self._lock:
+            self.held += size
+            self._update_state()
+            over_high = self._over_high
+        request.state.memory_held = getattr(request.state, "memory_held", 0) + size
+        return over_high
+
+    def admit(self, request, size):
+        """受信中のボディを計上し、高水位を超えたら読み続けずに例外で打ち切る"""
+        if self.hold_for(request, size):
+            self.record_shed()
+            raise MemoryBudgetExceeded("メモリの高水位を超えたため受信を中断しました")
+
+    def should_spill(self, size):
+        with self._lock:
+            return self._over_high or self.held + size > self.high
+
+    def shedding(self):
+        """新しいリクエストを断るべき状態か
+
+        高水位を超えている間は受信ボディを持てず、ディスクが満杯の間は
+        シンクへのイベントを捨てることになるため、どちらでも断る。
+        """
+        with self._lock:
+            return self._over_high or self._spill_full
+
+    def record_shed(self):
+        with self._lock:
+            self.shed_count += 1
+
+    def store(self, data):
+        """ペイロードの置き場所を決める。どちらも満杯なら例外
+
+        メモリに置く場合は data をそのまま返す。ディスクに置く場合は容量だけ確保した
+        SpilledPayload を返すので、呼び出し側が write_spill() で書き出す。
+        """
+        size = len(data)
+        if not self.should_spill(size):
+            self.reserve(size)
+            return data
+        with self._lock:
+            if self.spilled + size > self.spill_max:
+                self.shed_count += 1
+                self._spill_full = True
+                raise MemoryBudgetExceeded("メモリとディスクの上限に達しました")
+            self.spilled += size
+            self.spill_count += 1
+        return SpilledPayload(os.path.join(self.spill_dir, f"{uuid.uuid4().hex}.spill"), size)
+
+    def write_spill(self, stored, data):
+        """store() がディスクに割り当てたペイロードを書き出す（ブロッキングI/O）"""
+        # 書き終わるまでは data もメモリ上にあるので計上しておく
+        with self.hold(len(data)):
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(stored.path, "wb") as f:
+                f.write(data)
+
+    def load(self, stored):
+        """store() の戻り値から中身を取り出す"""
+        if isinstance(stored, SpilledPayload):
+            with open(stored.path, "rb") as f:
+                return f.read()
+        return stored
+
+    def discard(self, stored):
+        """store() で確保した分を解放する"""
+        if isinstance(stored, SpilledPayload):
+            try:
+                os.remove(stored.path)
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self.spilled -= stored.size
+                self._spill_full = False
+        else:
+            self.release(len(stored))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "held_bytes": self.held,
+                "peak_bytes": self.peak,
+                "spilled_bytes": self.spilled,
+                "high_watermark": self.high,
+                "low_watermark": self.low,
+                "spill_max_bytes": self.spill_max,
+                "over_high_watermark": self._over_high,
+                "spill_full": self._spill_full,
+                "spill_count": self.spill_count,
+                "shed_count": self.shed_count,
+            }
+
+
+memory_budget = MemoryBudget()
@@ -0,0 +1,117 @@
+from datetime import datetime
+from typing import Any, Dict, List, Literal, Optional, Union
+
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    TypeAdapter,
+    ValidationError,
+    field_validator,
+    model_validator,
+)
+
+from event_store import STATUSES
+
+# 保存済みイベントのステータスと種類
+EventStatus = Literal[STATUSES]
+EventKind = Literal["webhook", "chat"]
+
+
+class UrlVerification(BaseModel):
+    """Notionのwebhook認証チャレンジ"""
+    type: Literal["url_verification"]
+    challenge: str
+
+
+class NotionEntity(BaseModel):
+    """イベント対象（ページ・データベースなど）"""
+    model_config = ConfigDict(extra="allow")
+
+    id: str
+    type: str
+
+
+class NotionEvent(BaseModel):
+    """Notionから届く通常のwebhookイベント"""
+    model_config = ConfigDict(extra="allow")
+
+    # エンベロープとして最低限必要な項目
+    id: str
+    type: str
+    entity: NotionEntity
+    timestamp: Optional[datetime] = None
+    workspace_id: Optional[str] = None
+    subscription_id: Optional[str] = None
+    integration_id: Optional[str] = None
+    authors: List[Dict[str, Any]] = []
+    data: Dict[str, Any] = {}
+
+    @field_validator("type")
+    @classmethod
+    def reject_verification(cls, v):
+        # challengeの欠けた認証リクエストを通常イベントとして通さない
+        if v == "url_verification":
+            raise ValueError("url_verification にはchallengeが必要です")
+        return v
+
+
+class ChatRequest(BaseModel):
+    """/chat のリクエストボディ"""
+    message: str = ""
+    title: str = "無題の会話"
+    content: str = ""
+    summary: str = ""
+
+
+class EventFilter(BaseModel):
+    """保存済みイベントの絞り込み条件"""
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    status: Optional[EventStatus] = None
+    database_id: Optional[str] = None
+    kind: Optional[EventKind] = None
+    ids: List[int] = []
+
+
+class ReplayRequest(EventFilter):
+    """/admin/events/replay のリクエストボディ"""
+    # 既定では失敗したイベントだけを対象にする（処理済みのページを重複して作らない）。
+    # 全ステータスを対象にするには明示的に null を指定する（ids を指定した場合は既定で全ステータス）
+    status: Optional[EventStatus] = "failed"
+    # 1秒あたりに再処理するイベント数の上限
+    rate: float = Field(5.0, gt=0, le=100)
+    limit: int = Field(1000, gt=0)
+
+    @model_validator(mode="after")
+    def ids_select_any_status(self):
+        # IDを名指しした場合は、ステータスを明示しない限りそのイベントをそのまま対象にする
+        if self.ids and "status" not in self.model_fields_set:
+            self.status = None
+        return self
+
+
+# バリデータはモジュール読み込み時に一度だけ構築し、リクエストごとに再利用する
+webhook_adapter = TypeAdapter(Union[UrlVerification, NotionEvent])
+chat_adapter = TypeAdapter(ChatRequest)
+replay_adapter = TypeAdapter(ReplayRequest)
+
+
+def parse_webhook(raw):
+    """bytesから直接webhookボディをデコード・検証する"""
+    return webhook_adapter.validate_json(raw)
+
+
+def parse_chat(raw):
+    """bytesから直接/chatのボディをデコード・検証する"""
+    return chat_adapter.validate_json(raw)
+
+
+def parse_replay(raw):
+    """bytesから直接リプレイ条件をデコード・検証する"""
+    return replay_adapter.validate_json(raw)
+
+
+def validation_errors(e: ValidationError):
+    """レスポンスに載せる検証エラー（入力値は含めない）"""
+    return e.errors(include_url=False, include_context=False, include_input=False)
@@ -0,0 +1,196 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+from timestamps import TIMEZONE
+
+# これより遅いリクエストの内訳を記録する（ミリ秒）
+SLOW_REQUEST_THRESHOLD_MS = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", 1000))
+# 記録しておく遅いリクエストの件数
+SLOW_REQUEST_BUFFER_SIZE = int(os.getenv("SLOW_REQUEST_BUFFER_SIZE", 100))
+# サンプリングプロファイルの最大時間（秒）
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 60))
+
+
+class ProfilerBusyError(RuntimeError):
+    """別のプロファイルが実行中"""
+
+
+class SamplingProfiler:
+    """全スレッドのスタックを一定間隔で採取する"""
+
+    _lock = threading.Lock()
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self.elapsed = 0.0
+
+    def run(self, seconds):
+        """seconds 秒間サンプリングする（同時に実行できるのは1つだけ）"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("別のプロファイルが実行中です")
+        try:
+            own = threading.get_ident()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            started = time.perf_counter()
+            deadline = started + min(seconds, PROFILE_MAX_SECONDS)
+            while time.perf_counter() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    if ident not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    self.counts[self._stack(names.get(ident, str(ident)), frame)] += 1
+                self.samples += 1
+                time.sleep(self.interval)
+            self.elapsed = time.perf_counter() - started
+        finally:
+            self._lock.release()
+        return self
+
+    @staticmethod
+    def _stack(thread_name, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        stack.append((f"thread:{thread_name}", "", 0))
+        stack.reverse()
+        return tuple(stack)
+
+    def collapsed(self):
+        """flamegraph.pl などで読める collapsed stacks 形式"""
+        lines = []
+        for stack, count in self.counts.most_common():
+            names = ";".join(
+                name if not filename else f"{name} ({os.path.basename(filename)}:{line})"
+                for name, filename, line in stack
+            )
+            lines.append(f"{names} {count}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self, name="webhook-server"):
+        """speedscope (https://www.speedscope.app) のsampled形式"""
+        frames = []
+        index = {}
+        samples = []
+        weights = []
+        for stack, count in self.counts.items():
+            sample = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frame_name, filename, line = frame
+                    entry = {"name": frame_name}
+                    if filename:
+                        entry.update(file=filename, line=line)
+                    frames.append(entry)
+                sample.append(index[frame])
+            samples.append(sample)
+            weights.append(count * self.interval)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": name,
+            "exporter": "webhook-server",
+        }
+
+
+# リクエスト中の処理ごとの所要時間（記録対象外のときは None）
+_phase_timings = ContextVar("phase_timings", default=None)
+
+
+@contextmanager
+def timed(phase):
+    """リクエスト内の処理時間を phase 名で集計する"""
+    timings = _phase_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - started
+
+
+class SlowRequestRecorder:
+    """しきい値を超えたリクエストの内訳をリングバッファに残す"""
+
+    def __init__(self, threshold_ms=SLOW_REQUEST_THRESHOLD_MS, size=SLOW_REQUEST_BUFFER_SIZE):
+        self.threshold = threshold_ms / 1000
+        self.records = deque(maxlen=size)
+
+    def record(self, method, path, status, started_at, duration, timings):
+        if duration < self.threshold:
+            return
+        phases = {phase: round(seconds * 1000, 2) for phase, seconds in timings.items()}
+        phases["other"] = round((duration - sum(timings.values())) * 1000, 2)
+        self.records.append({
+            "method": method,
+            "path": path,
+            "status": status,
+            "started_at": datetime.fromtimestamp(started_at, TIMEZONE).isoformat(),
+            "duration_ms": round(duration * 1000, 2),
+            "phases": phases,
+        })
+
+    def recent(self):
+        return list(reversed(self.records))
+
+
+class SlowRequestMiddleware:
+    """リクエストの所要時間を測り、遅いものを SlowRequestRecorder に渡すASGIミドルウェア
+
+    プロファイルやリプレイのように長く続くのが正常な管理APIは記録しない。
+    """
+
+    def __init__(self, app, recorder, exclude_prefixes=("/admin",)):
+        self.app = app
+        self.recorder = recorder
+        self.exclude_prefixes = exclude_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude_prefixes):
+            await self.app(scope, receive, send)
+            return
+        timings = {}
+        token = _phase_timings.set(timings)
+        status = None
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _phase_timings.reset(token)
+            self.recorder.record(
+                scope["method"], scope["path"], status, started_at,
+                time.perf_counter() - started, timings
+            )
+
+
+slow_requests = SlowRequestRecorder()
@@ -0,0 +1,283 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+
+import requests
+
+from memory_budget import MemoryBudgetExceeded, SpilledPayload, memory_budget
+
+# 各シンクのキューに溜められるイベント数（超えた分は捨てる）
+SINK_QUEUE_SIZE = int(os.getenv("SINK_QUEUE_SIZE", 1000))
+# 書き込み失敗時の再試行回数と初回の待ち時間（秒、以降は倍々）
+SINK_MAX_RETRIES = int(os.getenv("SINK_MAX_RETRIES", 3))
+SINK_RETRY_DELAY = float(os.getenv("SINK_RETRY_DELAY", 1.0))
+
+
+class PermanentSinkError(Exception):
+    """再試行しても成功しない書き込みエラー"""
+
+
+class Sink:
+    """イベントの書き込み先。write はワーカースレッドから呼ばれる"""
+    name = "sink"
+
+    def write(self, event):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonlArchiveSink(Sink):
+    """イベントを1行1件のJSONとしてファイルに追記する"""
+    name = "jsonl"
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, event):
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+class SqliteArchiveSink(Sink):
+    """イベントをSQLiteに保存する（イベントIDで上書きするのでリプレイしても重複しない）"""
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS archive ("
+            " event_id INTEGER PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " database_id TEXT,"
+            " received_at TEXT NOT NULL,"
+            " event TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def write(self, event):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO archive (event_id, kind, database_id, received_at, event)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (event["event_id"], event["kind"], event["database_id"],
+                 event["received_at"], json.dumps(event, ensure_ascii=False)),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class WebhookSink(Sink):
+    """イベントを別のwebhookにPOSTする"""
+    name = "webhook"
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    # 4xxでも時間をおけば成功しうるステータス
+    RETRYABLE_CLIENT_ERRORS = (408, 429)
+
+    def write(self, event):
+        # 接続エラー・タイムアウトは requests の例外のまま送出して再試行させる
+        res = self._session.post(self.url, json=event, timeout=self.timeout)
+        if 400 <= res.status_code < 500 and res.status_code not in self.RETRYABLE_CLIENT_ERRORS:
+            raise PermanentSinkError(f"転送先がリクエストを拒否しました: {res.status_code}")
+        res.raise_for_status()
+
+    def close(self):
+        self._session.close()
+
+
+class QueuedPayload:
+    """シンク間で共有するシリアライズ済みイベント（全シンクの書き込み後に解放）"""
+
+    def __init__(self, stored, budget):
+        self.stored = stored
+        self.budget = budget
+        self.refs = 0
+        self._spill = None
+
+    def spill(self, data):
+        """ディスクに割り当てられていれば、イベントループの外で書き出し始める"""
+        if isinstance(self.stored, SpilledPayload):
+            self._spill = asyncio.create_task(
+                asyncio.to_thread(self.budget.write_spill, self.stored, data)
+            )
+
+    async def ready(self):
+        """書き出しが終わるのを待つ（失敗していれば例外）"""
+        if self._spill is not None:
+            await self._spill
+
+    def load(self):
+        return json.loads(self.budget.load(self.stored))
+
+    def done(self):
+        self.refs -= 1
+        if self.refs <= 0:
+            self.budget.discard(self.stored)
+
+
+class SinkWorker:
+    """シンクごとの独立したキューと再試行付きの書き込みループ"""
+
+    def __init__(self, sink, queue_size=SINK_QUEUE_SIZE,
+                 max_retries=SINK_MAX_RETRIES, retry_delay=SINK_RETRY_DELAY, log=print):
+        self.sink = sink
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.log = log
+        self.task = None
+        # スレッドで実行中の書き込み（キャンセルしても止まらない）
+        self._inflight = None
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retries = 0
+
+    def offer(self, payload):
+        """イベントをキューに入れる。満杯なら待たずに捨てる"""
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    async def run(self):
+        while True:
+            payload = await self.queue.get()
+            try:
+                await self._write_with_retry(payload)
+            finally:
+                inflight = self._inflight
+                if inflight is not None and not inflight.done():
+                    # 書き込み中にキャンセルされたら、スレッドが読み終えてから解放する
+                    inflight.add_done_callback(lambda _, payload=payload: payload.done())
+                else:
+                    payload.done()
+                self.queue.task_done()
+
+    async def stop(self, timeout):
+        """キューに残ったイベントを待ってから止める。書き込めなかったイベントは捨てたものとして数える"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        # 実行中の書き込みが終わるまでシンクを閉じない
+        if self._inflight is not None and not self._inflight.done():
+            await asyncio.wait([self._inflight])
+        while not self.queue.empty():
+            self.queue.get_nowait().done()
+            self.queue.task_done()
+            self.dropped += 1
+        self.sink.close()
+
+    def _write(self, payload):
+        self.sink.write(payload.load())
+
+    async def _write_with_retry(self, payload):
+        try:
+            await payload.ready()
+        except Exception as e:
+            self.failed += 1
+            self.log(f"❌ シンク({self.sink.name})向けのイベントを書き出せませんでした: {str(e)}")
+            return
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                # 既定のエグゼキュータで実行し、リクエスト処理用のスレッドプールを占有しない
+                self._inflight = asyncio.ensure_future(asyncio.to_thread(self._write, payload))
+                await asyncio.shield(self._inflight)
+                self.written += 1
+                return
+            except Exception as e:
+                if attempt == self.max_retries or isinstance(e, PermanentSinkError):
+                    self.failed += 1
+                    self.log(f"❌ シンク({self.sink.name})への書き込みに失敗: {str(e)}")
+                    return
+                self.retries += 1
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "written": self.written,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "retries": self.retries,
+        }
+
+
+class SinkPipeline:
+    """受け付けたイベントを複数のシンクへ並行して書き出す"""
+
+    def __init__(self, sinks, log=print, budget=memory_budget, **worker_options):
+        self.workers = [SinkWorker(sink, log=log, **worker_options) for sink in sinks]
+        self.budget = budget
+
+    def start(self):
+        for worker in self.workers:
+            if worker.task is None:
+                worker.task = asyncio.create_task(worker.run())
+
+    async def stop(self, timeout=5):
+        """キューに残ったイベントを待ってからワーカーを止める"""
+        for worker in self.workers:
+            await worker.stop(timeout)
+
+    def publish(self, data):
+        """シリアライズ済みのイベント（JSONのbytes）を全シンクのキューに入れる（どのシンクも待たない）"""
+        if not self.workers:
+            return
+        # 全シンクで共有し、高水位を超えていればディスクに置く
+        # （ファイルへの書き出しはスレッドで行い、レスポンスを待たせない）
+        try:
+            stored = self.budget.store(data)
+        except MemoryBudgetExceeded:
+            for worker in self.workers:
+                worker.dropped += 1
+            return
+        payload = QueuedPayload(stored, self.budget)
+        for worker in self.workers:
+            if worker.offer(payload):
+                payload.refs += 1
+        if payload.refs == 0:
+            self.budget.discard(stored)
+            return
+        payload.spill(data)
+
+    def stats(self):
+        return {worker.sink.name: worker.stats() for worker in self.workers}
+
+
+def sinks_from_env():
+    """環境変数で指定された副次シンクを作る"""
+    sinks = []
+    if os.getenv("SINK_JSONL_PATH"):
+        sinks.append(JsonlArchiveSink(os.getenv("SINK_JSONL_PATH")))
+    if os.getenv("SINK_SQLITE_PATH"):
+        sinks.append(SqliteArchiveSink(os.getenv("SINK_SQLITE_PATH")))
+    if os.getenv("SINK_WEBHOOK_URL"):
+        sinks.append(WebhookSink(os.getenv("SINK_WEBHOOK_URL")))
+    return sinks
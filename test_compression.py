@@ -0,0 +1,114 @@
+import asyncio
+import gzip
+import tracemalloc
+import zlib
+from types import SimpleNamespace
+
+import brotli
+import pytest
+import zstandard
+
+from compression import CorruptBodyError, PayloadTooLargeError, read_body
+
+# 展開後の上限と、それを大きく超えるzip bombの元データのサイズ
+LIMIT = 1024 * 1024
+BOMB_SIZE = 256 * 1024 * 1024
+# 上限超過を検出するまでに許容するPython側のメモリ確保量
+PEAK_ALLOWED = 16 * 1024 * 1024
+
+
+class FakeRequest:
+    """read_body が使う最小限のリクエスト"""
+
+    def __init__(self, body, encoding, chunk_size=64 * 1024):
+        self.headers = {"content-encoding": encoding}
+        self.state = SimpleNamespace()
+        self._body = body
+        self._chunk_size = chunk_size
+
+    async def stream(self):
+        for i in range(0, len(self._body), self._chunk_size):
+            yield self._body[i:i + self._chunk_size]
+
+
+def compress_zeros(compressor, flush):
+    """BOMB_SIZE バイトのゼロを1MBずつ圧縮する（テスト側で巨大なbytesを作らない）"""
+    block = bytes(1024 * 1024)
+    out = [compressor(block) for _ in range(BOMB_SIZE // len(block))]
+    out.append(flush())
+    return b"".join(out)
+
+
+def gzip_bomb():
+    obj = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compress_zeros(obj.compress, obj.flush)
+
+
+def deflate_bomb():
+    obj = zlib.compressobj(9)
+    return compress_zeros(obj.compress, obj.flush)
+
+
+def brotli_bomb():
+    obj = brotli.Compressor(quality=5)
+    return compress_zeros(obj.process, obj.finish)
+
+
+def zstd_bomb():
+    obj = zstandard.ZstdCompressor().compressobj()
+    return compress_zeros(obj.compress, obj.flush)
+
+
+def read(body, encoding, **kwargs):
+    return asyncio.run(read_body(FakeRequest(body, encoding), **kwargs))
+
+
+@pytest.mark.parametrize("encoding, make_bomb", [
+    ("gzip", gzip_bomb),
+    ("deflate", deflate_bomb),
+    ("br", brotli_bomb),
+    ("zstd", zstd_bomb),
+])
+def test_bomb_is_rejected_without_expanding(encoding, make_bomb):
+    bomb = make_bomb()
+    tracemalloc.start()
+    try:
+        with pytest.raises(PayloadTooLargeError):
+            read(bomb, encoding, max_bytes=LIMIT)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < PEAK_ALLOWED
+
+
+@pytest.mark.parametrize("encoding, compress", [
+    ("identity", lambda b: b),
+    ("gzip", gzip.compress),
+    # 複数メンバーのgzip（RFC 1952）
+    ("gzip", lambda b: gzip.compress(b[:100]) + gzip.compress(b[100:])),
+    ("deflate", zlib.compress),
+    ("deflate", lambda b: zlib.compress(b, wbits=-zlib.MAX_WBITS)),
+    ("br", brotli.compress),
+    ("zstd", lambda b: zstandard.ZstdCompressor().compress(b)),
+])
+def test_round_trip(encoding, compress):
+    body = '{"message": "保存", "content": "会話"}'.encode() * 1000
+    assert read(compress(body), encoding) == body
+
+
+@pytest.mark.parametrize("encoding, compress", [
+    ("gzip", gzip.compress),
+    ("deflate", zlib.compress),
+    ("br", brotli.compress),
+    ("zstd", lambda b: zstandard.ZstdCompressor().compress(b)),
+])
+def test_corrupt_or_truncated_body(encoding, compress):
+    data = compress(b'{"message": "hello"}' * 100)
+    with pytest.raises(CorruptBodyError):
+        read(data[:len(data) // 2], encoding)
+    with pytest.raises(CorruptBodyError):
+        read(b"\xff" * 64, encoding)
+    # 終端の後ろに余分なデータが続く
+    with pytest.raises(CorruptBodyError):
+        read(data + b"GARBAGE", encoding)
+
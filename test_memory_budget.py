@@ -0,0 +1,107 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from compression import PayloadTooLargeError, read_body
+from memory_budget import MemoryBudget, MemoryBudgetExceeded, SpilledPayload
+from sinks import Sink, SinkPipeline
+
+
+@pytest.fixture
+def budget(tmp_path):
+    return MemoryBudget(high=1000, low=500, spill_dir=str(tmp_path), spill_max=1500)
+
+
+class FakeRequest:
+    """read_body / admit が使う最小限のリクエスト"""
+
+    def __init__(self, body=b""):
+        self.headers = {}
+        self.state = SimpleNamespace()
+        self._body = body
+
+    async def stream(self):
+        yield self._body
+
+
+class RecordingSink(Sink):
+    def __init__(self, name):
+        self.name = name
+        self.events = []
+
+    def write(self, event):
+        self.events.append(event)
+
+
+def test_hysteresis_between_watermarks(budget):
+    budget.reserve(1200)
+    assert budget.shedding()
+    # 高水位を下回っても、低水位を下回るまでは断り続ける
+    budget.release(400)
+    assert budget.shedding()
+    assert budget.should_spill(1)
+    budget.release(400)
+    assert not budget.shedding()
+    assert not budget.should_spill(1)
+    assert budget.stats()["peak_bytes"] == 1200
+
+
+def test_spill_full_is_cleared_by_discard(budget):
+    budget.reserve(900)
+    spilled = budget.store(b"x" * 1000)
+    assert isinstance(spilled, SpilledPayload)
+    budget.write_spill(spilled, b"x" * 1000)
+    assert budget.load(spilled) == b"x" * 1000
+
+    with pytest.raises(MemoryBudgetExceeded):
+        budget.store(b"y" * 1000)
+    budget.release(900)
+    # メモリに余裕ができても、ディスクが満杯の間は断る
+    assert budget.shedding()
+
+    budget.discard(spilled)
+    assert not os.path.exists(spilled.path)
+    assert not budget.shedding()
+    assert budget.stats()["spilled_bytes"] == 0
+
+
+def test_admit_sheds_over_high_watermark(budget):
+    request = FakeRequest()
+    budget.admit(request, 600)
+    with pytest.raises(MemoryBudgetExceeded):
+        budget.admit(request, 600)
+    # 打ち切った分も含めて、リクエスト終了時に解放できるよう記録されている
+    assert request.state.memory_held == 1200
+    assert budget.shedding()
+    budget.release(request.state.memory_held)
+    assert budget.stats()["held_bytes"] == 0
+
+
+def test_body_larger_than_high_watermark_is_too_large(budget):
+    with pytest.raises(PayloadTooLargeError):
+        asyncio.run(read_body(FakeRequest(b"x" * 1001), budget=budget))
+    assert not budget.shedding()
+
+
+def test_shared_payload_is_released_after_every_sink(budget):
+    sinks = [RecordingSink("a"), RecordingSink("b")]
+
+    async def publish_and_stop():
+        pipeline = SinkPipeline(sinks, budget=budget)
+        pipeline.start()
+        budget.reserve(1000)
+        # 高水位に達しているのでディスクに書き出される
+        pipeline.publish(b'{"event_id": 1}')
+        assert budget.stats()["spilled_bytes"] > 0
+        budget.release(1000)
+        await pipeline.stop()
+        return pipeline.stats()
+
+    stats = asyncio.run(publish_and_stop())
+    assert [sink.events for sink in sinks] == [[{"event_id": 1}], [{"event_id": 1}]]
+    assert all(s["written"] == 1 for s in stats.values())
+    assert budget.stats()["spilled_bytes"] == 0
+    assert budget.stats()["held_bytes"] == 0
+    assert os.listdir(budget.spill_dir) == []
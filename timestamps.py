@@ -0,0 +1,73 @@
+import os
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# Notionの日付プロパティに書き込むタイムゾーン（ホストのTZには依存しない）
+TIMEZONE = ZoneInfo(os.getenv("NOTION_TIMEZONE", "Asia/Tokyo"))
+
+DATE = "date"
+DATETIME = "datetime"
+GRANULARITIES = (DATE, DATETIME)
+
+
+def _parse_granularity_config(value):
+    """NOTION_DATE_GRANULARITY を解析する
+
+    "datetime" のような単一指定、または "dbid1=date,dbid2=datetime" の
+    データベースごとの指定を受け付ける（"*=..." で既定値を上書き）。
+    """
+    default = DATETIME
+    per_database = {}
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if "=" in item:
+            database_id, granularity = (s.strip() for s in item.split("=", 1))
+        else:
+            database_id, granularity = "*", item
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"不正な日付粒度です: {granularity}")
+        if database_id == "*":
+            default = granularity
+        else:
+            per_database[database_id.replace("-", "")] = granularity
+    return default, per_database
+
+
+_DEFAULT_GRANULARITY, _GRANULARITY_BY_DATABASE = _parse_granularity_config(
+    os.getenv("NOTION_DATE_GRANULARITY")
+)
+
+
+def granularity_for(database_id):
+    """データベースに設定された日付粒度を返す"""
+    key = (database_id or "").replace("-", "")
+    return _GRANULARITY_BY_DATABASE.get(key, _DEFAULT_GRANULARITY)
+
+
+class TimestampService:
+    """タイムゾーン付きISO-8601文字列を秒単位でキャッシュして返す"""
+
+    def __init__(self, tz=TIMEZONE, clock=time.time):
+        self.tz = tz
+        self._clock = clock
+        # (秒, {粒度: 文字列}) を一つのタプルで保持し、差し替えを原子的にする
+        self._cache = (None, {})
+
+    def now(self, granularity=DATETIME):
+        second = int(self._clock())
+        cached_second, formatted = self._cache
+        if cached_second == second:
+            return formatted[granularity]
+        current = datetime.fromtimestamp(second, self.tz)
+        formatted = {
+            DATE: current.date().isoformat(),
+            DATETIME: current.isoformat(),
+        }
+        self._cache = (second, formatted)
+        return formatted[granularity]
+
+
+timestamps = TimestampService()
@@ -6,6 +6,7 @@ import json
 import hmac
 import hashlib
 from datetime import datetime
+from zoneinfo import ZoneInfo
 from notion_client import Client
 
 # 常に.envを読み込む（開発環境でもプロダクション環境でも）
@@ -19,6 +20,8 @@ DATABASE_ID = os.getenv("NOTION_DATABASE_ID")
 NOTION_TOKEN = os.getenv("NOTION_TOKEN")
 original_db_id = os.getenv("NOTION_DATABASE_ID")
 IS_PRODUCTION = os.getenv('FLASK_ENV') == 'production'
+# ホストのTZに依存しないよう日付は指定タイムゾーンで計算する
+TIMEZONE = ZoneInfo(os.getenv("NOTION_TIMEZONE", "Asia/Tokyo"))
 
 # デバッグ用：環境変数の値を確認
 print(f"Original Database ID: {original_db_id}")
@@ -84,7 +87,7 @@ def create_notion_page(title, summary, full_text):
                 },
                 "Date": {
                     "date": {
-                        "start": datetime.now().date().isoformat()
+                        "start": datetime.now(TIMEZONE).date().isoformat()
                     }
                 },
                 "Summary": {